@@ -3,7 +3,8 @@
 #reason for your aiohttp requests is to  be able to upgrade to higher version of
 #elastic search without having to depend on version of aioes and aiohttp
 import logging, aiohttp, json
-from asyncio import coroutine, async
+from asyncio import ensure_future
+from types import coroutine
 logger = logging.getLogger(__name__)
 
 
@@ -131,14 +132,13 @@ class elasticsearch:
         response = yield from cls.session.request('post', url=url, data=body, headers={'Content-Type': 'application/json'})
         result = yield from response.json()
         if refresh:
-            async(cls.refresh(index))
+            ensure_future(cls.refresh(index))
         return result
 
     @classmethod
-    @coroutine
-    def refresh(cls, index):
-        response = yield from cls.session.request('post', url="{}/{}/_refresh".format(cls.url, index) ,headers={'Content-Type': 'application/json'})
-        yield from response.text()
+    async def refresh(cls, index):
+        response = await cls.session.request('post', url="{}/{}/_refresh".format(cls.url, index) ,headers={'Content-Type': 'application/json'})
+        await response.text()
 
 
     @classmethod
@@ -158,7 +158,7 @@ class elasticsearch:
              return res
         results = yield  from response.json()
         if refresh:
-            async(cls.refresh(index) )
+            ensure_future(cls.refresh(index) )
         return results
 
     @classmethod
@@ -194,7 +194,7 @@ class elasticsearch:
             url = "{}/{}/{}".format(cls.url, index, id)
         response = yield from cls.session.request('delete', url=url, headers={'Content-Type': 'application/json'})
         result = yield from response.json()
-        async(cls.refresh())
+        ensure_future(cls.refresh())
         if response.status == 200:
             return result
         elif ignore and response.status in ignore:
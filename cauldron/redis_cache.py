@@ -1,58 +1,374 @@
 import asyncio
 import aioredis
-from asyncio import coroutine
+from collections import OrderedDict
+from contextlib import suppress
 from functools import wraps
 import json
-import hashlib
 import inspect
-allowed_types_for_caching = [str, int, list, tuple, float, dict, bool]
+import logging
+import math
+import os
+import struct
+import time
+import types
 
-class RedisCache:
-    _pool = None
-    _host = None
-    _port = None
-    _minsize = None
-    _maxsize = None
-    _lock = asyncio.Semaphore(1)
-    _utf8 = 'utf-8'
+import xxhash
 
-    @classmethod
-    @coroutine
-    def get_pool(cls):
-        if not cls._pool:
-            with (yield from cls._lock):
-                if not cls._pool:
-                    cls._pool = yield from aioredis.create_pool((cls._host, cls._port), minsize=cls._minsize,
-                                                                maxsize=cls._maxsize)
-        return (yield from cls._pool)
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-    @classmethod
-    def connect_v2(cls, host, port, minsize=5, maxsize=10, loop=None):
-        """
-        Setup a connection pool params
-        :param host: Redis host
-        :param port: Redis port
-        :param loop: Event loop
-        """
-        cls._host = host
-        cls._port = port
-        cls._minsize = minsize
-        cls._maxsize = maxsize
+logger = logging.getLogger(__name__)
 
-    @classmethod
-    @coroutine
-    def connect(cls, host, port, minsize=5, maxsize=10, loop=asyncio.get_event_loop()):
-        """
-        Setup a connection pool
-        :param host: Redis host
-        :param port: Redis port
-        :param loop: Event loop
-        """
-        cls._pool = yield from aioredis.create_pool((host, port), minsize=minsize, maxsize=maxsize, loop=loop)
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
 
-    @classmethod
-    @coroutine
-    def set_key(cls, key, value, namespace=None, expire=0):
+
+def _orjson_safe(value):
+    """
+    Whether value is made only of types that orjson encodes and decodes exactly like json. orjson also accepts
+    types json rejects (datetimes, UUIDs, enums, dataclasses) and turns NaN into null, so anything else is left
+    to json, keeping the set of cacheable values the same whether orjson is installed or not
+    """
+    t = type(value)
+    if t is str or t is bool or value is None:
+        return True
+    if t is int:
+        return _INT64_MIN <= value <= _INT64_MAX
+    if t is float:
+        return math.isfinite(value)
+    if t is list or t is tuple:
+        for item in value:
+            if not _orjson_safe(item):
+                return False
+        return True
+    if t is dict:
+        for k, item in value.items():
+            if type(k) is not str or not _orjson_safe(item):
+                return False
+        return True
+    return False
+
+
+# cached values are encoded with orjson when it is installed, falling back to the standard library
+if orjson is not None:
+    _orjson_dumps = orjson.dumps
+    _orjson_loads = orjson.loads
+    _JSON_MARKS = (' ', b' ')
+
+    def _dumps(value):
+        if _orjson_safe(value):
+            return _orjson_dumps(value)
+        # json output is marked with leading whitespace, which any json parser skips, so that _loads reads it back
+        # with json rather than orjson (which would turn big integers into floats and reject NaN)
+        return ' ' + json.dumps(value)
+
+    def _loads(value):
+        if value[:1] in _JSON_MARKS:
+            return json.loads(value)
+        return _orjson_loads(value)
+else:
+    _dumps = json.dumps
+    _loads = json.loads
+
+_hasher = xxhash.xxh3_128
+_pack_float = struct.Struct('<d').pack
+
+allowed_types_for_caching = frozenset({str, int, list, tuple, float, dict, bool})
+
+
+def _hash_str(update, value):
+    b = value.encode()
+    update(b's%d:' % len(b))
+    update(b)
+
+
+def _hash_bool(update, value):
+    update(b'T' if value else b'F')
+
+
+def _hash_int(update, value):
+    update(b'i%d:' % value)
+
+
+def _hash_float(update, value):
+    update(b'f')
+    update(_pack_float(value))
+
+
+def _hash_none(update, value):
+    update(b'N')
+
+
+def _hash_dict(update, value):
+    update(b'd%d:' % len(value))
+    for k in sorted(value):
+        _hash_value(update, k)
+        _hash_value(update, value[k])
+
+
+def _hash_list(update, value):
+    update(b'l%d:' % len(value))
+    for item in value:
+        _hash_value(update, item)
+
+
+def _hash_tuple(update, value):
+    update(b't%d:' % len(value))
+    for item in value:
+        _hash_value(update, item)
+
+
+def _hash_repr(update, value):
+    b = repr(value).encode()
+    update(b'r%d:' % len(b))
+    update(b)
+
+
+_ARG_HANDLERS = {
+    str: _hash_str,
+    bool: _hash_bool,
+    int: _hash_int,
+    float: _hash_float,
+    type(None): _hash_none,
+    dict: _hash_dict,
+    list: _hash_list,
+    tuple: _hash_tuple,
+}
+
+
+def _hash_value(update, value):
+    """
+    Feeds a type tagged, length prefixed encoding of value to a running hash so that
+    different arguments can't produce the same byte stream
+    """
+    _ARG_HANDLERS.get(type(value), _hash_repr)(update, value)
+
+
+_SCAN_COUNT = 1000
+_UNLINK_BATCH = 512
+
+_pending_writes = set()
+
+
+def _write_behind(coro):
+    """
+    Schedules a cache write without waiting for it, holding a reference to the task until it is done
+    """
+    task = asyncio.ensure_future(coro)
+    _pending_writes.add(task)
+    task.add_done_callback(_write_done)
+
+
+def _write_done(task):
+    _pending_writes.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Failed to write cache entry", exc_info=task.exception())
+
+
+async def _unlink_matching(redis, pattern):
+    """
+    Deletes every key matching pattern and returns how many were removed.
+    Walks the keyspace with SCAN, which unlike KEYS doesn't block the server, and frees the keys with UNLINK
+    in batches. Each UNLINK is left in flight while the next page is scanned so the two pipeline on the connection.
+    The count is taken from the UNLINK replies, as SCAN may return a key more than once.
+    """
+    # the high level client has no UNLINK command, the raw connection returns the reply as a future
+    execute = redis.connection.execute
+    deleted = 0
+    batch = []
+    unlinking = None
+    cursor = 0
+    try:
+        while True:
+            cursor, keys = await redis.scan(cursor, match=pattern, count=_SCAN_COUNT)
+            batch.extend(keys)
+            if batch and (len(batch) >= _UNLINK_BATCH or not cursor):
+                if unlinking is not None:
+                    deleted += await unlinking
+                unlinking = execute(b'UNLINK', *batch)
+                batch = []
+            if not cursor:
+                break
+    except BaseException:
+        # the in-flight reply is still collected so that its outcome is not left unretrieved
+        if unlinking is not None:
+            with suppress(Exception):
+                await unlinking
+        raise
+    if unlinking is not None:
+        deleted += await unlinking
+    return deleted
+
+
+def _call_digest(func_name: bytes, args, kwargs, allowed_types=None) -> str:
+    """
+    Digest of a call used as its cache key, streamed straight into xxh3_128 without serializing the call first
+    :param func_name: encoded qualified name of the cached function
+    :param allowed_types: if given, arguments of any other type are left out of the key
+    """
+    h = _hasher(func_name)
+    update = h.update
+    for arg in args:
+        if allowed_types is None or type(arg) in allowed_types:
+            _hash_value(update, arg)
+    update(b'|')
+    for key in sorted(kwargs):
+        value = kwargs[key]
+        if allowed_types is None or type(value) in allowed_types:
+            _hash_value(update, key)
+            _hash_value(update, value)
+    return h.hexdigest()
+
+
+_DEFAULT_POOL_MIN = 10
+_DEFAULT_POOL_MAX = 50
+
+
+def _pool_bounds(minsize=None, maxsize=None, pool_size=None):
+    """
+    Resolves the pool's minsize and maxsize: pool_size pins both, otherwise explicit arguments win over the
+    REDIS_POOL_MIN / REDIS_POOL_MAX environment variables, which win over the defaults
+    """
+    if pool_size is not None:
+        return pool_size, pool_size
+    if maxsize is None:
+        maxsize = int(os.environ.get('REDIS_POOL_MAX', _DEFAULT_POOL_MAX))
+    if minsize is None:
+        minsize = min(int(os.environ.get('REDIS_POOL_MIN', _DEFAULT_POOL_MIN)), maxsize)
+    return minsize, maxsize
+
+
+_MISSING = object()
+
+
+class _LocalCache:
+    """
+    Bounded in-process LRU of decoded cache values, consulted before going to redis.
+    Entries expire expire_time seconds after they were copied from redis, so a value can be served for up to
+    twice expire_time after it was written, and deleting the redis key does not evict it. expire_time must
+    therefore be positive, so that stale values do not live until they are evicted.
+    Values are shared between callers and must not be mutated.
+    """
+    __slots__ = ('_entries', '_size', '_ttl')
+
+    def __init__(self, size, expire_time):
+        if expire_time <= 0:
+            raise ValueError('l1_size requires a positive expire_time')
+        self._entries = OrderedDict()
+        self._size = size
+        self._ttl = expire_time
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        entries = self._entries
+        entries[key] = (time.monotonic() + self._ttl, value)
+        entries.move_to_end(key)
+        if len(entries) > self._size:
+            entries.popitem(last=False)
+
+
+class _GetBatcher:
+    """
+    Coalesces the GETs issued during one event loop iteration into a single MGET on the owner.
+    Concurrent reads of the same key share one MGET reply.
+    """
+    __slots__ = ('_owner', '_pending', '_flushes')
+
+    def __init__(self, owner):
+        self._owner = owner
+        self._pending = None
+        self._flushes = set()
+
+    def get(self, key):
+        pending = self._pending
+        if pending is None:
+            pending = self._pending = {}
+            # the flush task first runs on the next loop iteration, after every GET issued in this one
+            task = asyncio.ensure_future(self._flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        future = pending.get(key)
+        if future is None:
+            future = pending[key] = asyncio.get_event_loop().create_future()
+        # each caller gets its own view of the shared future, so cancelling one read doesn't cancel the others
+        return asyncio.shield(future)
+
+    async def _flush(self):
+        pending, self._pending = self._pending, None
+        try:
+            values = await self._owner.mget(*pending)
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future, value in zip(pending.values(), values):
+                if not future.done():
+                    future.set_result(value)
+
+
+class _PoolConnection:
+    """
+    Async context manager that borrows a connection from the owner's pool for the duration of the block
+    """
+    __slots__ = ('_owner', '_ctx')
+
+    def __init__(self, owner):
+        self._owner = owner
+        self._ctx = None
+
+    async def __aenter__(self):
+        pool = self._owner._pool
+        if pool is None:
+            pool = await self._owner.get_pool()
+        self._ctx = pool.get()
+        return await self._ctx.__aenter__()
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        return await self._ctx.__aexit__(exc_type, exc_value, tb)
+
+
+class _RedisOps:
+    """
+    Redis commands and caching decorators shared by RedisCache, which keeps its pool on the class, and
+    RedisCacheV2, which keeps one per instance. The methods only reach the pool and settings through self,
+    so they work bound to either the class or an instance.
+    """
+    _utf8 = 'utf-8'
+
+    async def get_pool(self):
+        if self._pool is not None:
+            return self._pool
+        # created on first use so that it is bound to the running event loop rather than the one current at import time
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._pool is None:
+                self._pool = await aioredis.create_pool((self._host, self._port), minsize=self._minsize,
+                                                        maxsize=self._maxsize)
+        return self._pool
+
+    def _conn(self):
+        return _PoolConnection(self)
+
+    def _coalesced_get(self, key):
+        if self._get_batcher is None:
+            self._get_batcher = _GetBatcher(self)
+        return self._get_batcher.get(key)
+
+    async def set_key(self, key, value, namespace=None, expire=0):
         """
         Set a key in a cache.
         :param key: Key name
@@ -61,48 +377,39 @@ class RedisCache:
         :param expire: expiration
         :return:
         """
-        with (yield from cls.get_pool()) as redis:
-            if namespace is not None:
-                key = cls._get_key(namespace, key)
-            yield from redis.set(key, value, expire=expire)
+        if namespace is not None:
+            key = f'{namespace}:{key}'
+        async with self._conn() as redis:
+            await redis.set(key, value, expire=expire)
 
-    @classmethod
-    def get_next_sequence_number(cls, key, namespace=None):
+    async def incr(self, key, value:int=1, namespace=None):
+        # Increments key by value and returns the new value
+        if namespace is not None:
+            key = f'{namespace}:{key}'
+        async with self._conn() as redis:
+            if value == 1:
+                return await redis.incr(key)
+            return await redis.incrby(key, value)
+
+    async def get_next_sequence_number(self, key, namespace=None):
         # Increments key with 1 and returns value
-        with (yield from cls.get_pool()) as redis:
-            if namespace is not None:
-                key = cls._get_key(namespace, key)
-            return (yield from redis.incr(key))
+        return await self.incr(key, namespace=namespace)
 
-    @classmethod
-    @coroutine
-    def increment_value(cls, key, namespace=None):
+    async def increment_value(self, key, namespace=None):
         # Set a redis key and increment the value by one
-        with (yield from cls.get_pool()) as redis:
-            if namespace is not None:
-                key = cls._get_key(namespace, key)
-            yield from redis.incr(key)
+        await self.incr(key, namespace=namespace)
 
-    @classmethod
-    @coroutine
-    def increment_by_value(cls, key, value:int, namespace=None):
-        with (yield from cls.get_pool()) as redis:
-            if namespace is not None:
-                key = cls._get_key(namespace, key)
-            yield from redis.incrby(key, value)
+    async def increment_by_value(self, key, value:int, namespace=None):
+        await self.incr(key, value, namespace)
 
-    @classmethod
-    @coroutine
-    def decrement_value(cls, key, namespace=None):
+    async def decrement_value(self, key, namespace=None):
         # Set a redis key and decrement the value by one
-        with (yield from cls.get_pool()) as redis:
-            if namespace is not None:
-                key = cls._get_key(namespace, key)
-            yield from redis.decr(key)
+        if namespace is not None:
+            key = self._get_key(namespace, key)
+        async with self._conn() as redis:
+            await redis.decr(key)
 
-    @classmethod
-    @coroutine
-    def set_key_if_not_exists(cls, key, value, namespace=None, expire=0):
+    async def set_key_if_not_exists(self, key, value, namespace=None, expire=0):
         """
         Set a redis key and return True if the key does not exists else return False
         :param key: Key name
@@ -111,577 +418,320 @@ class RedisCache:
         :param expire: expiration
         :return:
         """
-        with (yield from cls.get_pool()) as redis:
-            if namespace:
-                key = cls._get_key(namespace, key)
-            return (yield from redis.set(key, value, expire=expire, exist='SET_IF_NOT_EXIST'))
+        if namespace:
+            key = self._get_key(namespace, key)
+        async with self._conn() as redis:
+            return await redis.set(key, value, expire=expire, exist='SET_IF_NOT_EXIST')
 
-    @classmethod
-    @coroutine
-    def get_key(cls, key, namespace=None):
-        with (yield from cls.get_pool()) as redis:
-            if namespace is not None:
-                key = cls._get_key(namespace, key)
-            return (yield from redis.get(key, encoding=cls._utf8))
+    async def get_key(self, key, namespace=None):
+        if namespace is not None:
+            key = f'{namespace}:{key}'
+        async with self._conn() as redis:
+            return await redis.get(key, encoding=self._utf8)
 
-    @classmethod
-    @coroutine
-    def sadd(cls, key, *values, namespace=None):
-        with (yield from cls.get_pool()) as redis:
-            if namespace is not None:
-                key = cls._get_key(namespace, key)
-            return (yield from redis.sadd(key, *values))
+    async def mset(self, *pairs):
+        async with self._conn() as redis:
+            return await redis.mset(*pairs)
 
-    @classmethod
-    @coroutine
-    def sismember(cls, key, value, namespace=None):
-        with (yield from cls.get_pool()) as redis:
-            if namespace is not None:
-                key = cls._get_key(namespace, key)
-            return (yield from redis.sismember(key, value))
+    async def mget(self, *keys):
+        async with self._conn() as redis:
+            return await redis.mget(*keys, encoding=self._utf8)
 
-    @classmethod
-    @coroutine
-    def hmget(cls, fields, namespace=''):
-        with (yield from cls.get_pool()) as redis:
-            return (yield from redis.hmget(namespace, *fields))
+    async def sadd(self, key, *values, namespace=None):
+        if namespace is not None:
+            key = self._get_key(namespace, key)
+        async with self._conn() as redis:
+            return await redis.sadd(key, *values)
 
-    @classmethod
-    @coroutine
-    def hmset(cls, field, value, namespace=''):
-        with (yield from cls.get_pool()) as redis:
-            yield from redis.hmset(namespace, field, value)
+    async def sismember(self, key, value, namespace=None):
+        if namespace is not None:
+            key = self._get_key(namespace, key)
+        async with self._conn() as redis:
+            return await redis.sismember(key, value)
 
-    @classmethod
-    @coroutine
-    def delete(cls, key, namespace=None):
-        with (yield from cls.get_pool()) as redis:
-            if namespace is not None:
-                key = cls._get_key(namespace, key)
-            yield from redis.delete(key)
+    async def hmget(self, fields, namespace=''):
+        async with self._conn() as redis:
+            return await redis.hmget(namespace, *fields)
 
-    @classmethod
-    def delete_keys(cls, *keys, namespace=None):
-        with (yield from cls.get_pool()) as redis:
-            if namespace is not None:
-                keys = [cls._get_key(namespace, key) for key in keys]
-            yield from redis.delete(*keys)
+    async def hmset(self, field, value, namespace=''):
+        async with self._conn() as redis:
+            await redis.hmset(namespace, field, value)
 
-    @classmethod
-    def hdel(cls, key, namespace):
-        with (yield from cls.get_pool()) as redis:
-            if namespace is not None:
-                yield from redis.hdel(namespace, key)
+    async def hget(self, field, namespace=''):
+        async with self._conn() as redis:
+            return await redis.hget(namespace, field)
 
-    @classmethod
-    def hgetall(cls, namespace):
-        with (yield from cls.get_pool()) as redis:
-            if namespace is not None:
-                return (yield from redis.hgetall(namespace, encoding=cls._utf8))
+    async def hset(self, field, value, namespace=''):
+        async with self._conn() as redis:
+            return await redis.hset(namespace, field, value)
 
-    @classmethod
-    @coroutine
-    def clear_namespace(cls, namespace) -> int:
+    async def delete(self, key, namespace=None):
+        if namespace is not None:
+            key = self._get_key(namespace, key)
+        async with self._conn() as redis:
+            await redis.delete(key)
+
+    async def delete_keys(self, *keys, namespace=None):
+        if namespace is not None:
+            keys = [self._get_key(namespace, key) for key in keys]
+        async with self._conn() as redis:
+            await redis.delete(*keys)
+
+    async def hdel(self, key, namespace):
+        if namespace is not None:
+            async with self._conn() as redis:
+                await redis.hdel(namespace, key)
+
+    async def hgetall(self, namespace):
+        if namespace is not None:
+            async with self._conn() as redis:
+                return await redis.hgetall(namespace, encoding=self._utf8)
+
+    async def clear_namespace(self, namespace) -> int:
         pattern = namespace + '*'
-        return (yield from cls._delete_by_pattern(pattern))
+        return await self._delete_by_pattern(pattern)
 
-    @classmethod
-    @coroutine
-    def _delete_by_pattern(cls, pattern: str) -> int:
+    async def _delete_by_pattern(self, pattern: str) -> int:
         if not pattern:
             return 0
-        with (yield from cls.get_pool()) as redis:
-            _keys = yield from redis.keys(pattern)
-            if _keys:
-                yield from redis.delete(*_keys)
-        return len(_keys)
+        async with self._conn() as redis:
+            return await _unlink_matching(redis, pattern)
 
-    @classmethod
-    @coroutine
-    def delete_by_prefix(cls, prefix, namespace=None):
-        prefix_with_namespace = cls._get_key(namespace, prefix) if namespace else prefix
+    async def delete_by_prefix(self, prefix, namespace=None):
+        prefix_with_namespace = self._get_key(namespace, prefix) if namespace else prefix
         pattern = '{}*'.format(prefix_with_namespace)
-        return (yield from cls._delete_by_pattern(pattern))
+        return await self._delete_by_pattern(pattern)
 
-    @classmethod
-    @coroutine
-    def exit(cls):
-        if cls._pool:
-            yield from cls._pool.clear()
+    async def exit(self):
+        if self._pool:
+            await self._pool.clear()
 
     @staticmethod
     def _get_key(namespace, key):
-        return namespace + ':' + key
+        return f'{namespace}:{key}'
 
-    @classmethod
-    def asyncio_redis_decorator(cls, name_space=''):
+    def _cache_decorator(self, name_space, expire_time, l1_size, allowed, call_plain):
+        """
+        Builds a read-through cache decorator: results are looked up in the in-process tier and then in redis,
+        and on a miss the function is called and its result written behind
+        :param allowed: if given, arguments of any other type are left out of the key
+        :param call_plain: call functions that are neither coroutine nor generator functions directly
+        """
         def wrapped(func):
+            # generator based functions are wrapped so that they can still be awaited,
+            # plain ones are awaited too unless call_plain is set
+            is_coroutine = not call_plain or inspect.iscoroutinefunction(func) or inspect.isgeneratorfunction(func)
+            _func = types.coroutine(func)
+            func_name = func.__qualname__.encode()
+            # bound once here so that every call reads closure cells instead of globals and attributes
+            dumps, loads, digest, write_behind = _dumps, _loads, _call_digest, _write_behind
+            coalesced_get, set_key, missing = self._coalesced_get, self.set_key, _MISSING
+            # optional in-process tier in front of redis, off unless l1_size is given. Deletes don't reach it, so
+            # it needs a positive expire_time and may serve values up to twice that old, see _LocalCache
+            l1 = _LocalCache(l1_size, expire_time) if l1_size else None
+            # read keys are namespaced the same way set_key namespaces the writes
+            key_prefix = f'{name_space}:' if name_space is not None else ''
+
             @wraps(func)
-            def redis_check(*args, **kwargs):
-                _args = ''
-                if args and len(args) > 0:
-                    new_args = []
-                    for arg in args[1:]:
-                        if isinstance(arg, dict):
-                            new_args.append(json.dumps(arg, sort_keys=True))
-                        else:
-                            new_args.append(arg)
-                    _args = str(new_args)
-                redis_key = json.dumps({'func': func.__name__, 'args': _args, 'kwargs': kwargs}, sort_keys=True)
-                digest_key = hashlib.md5(redis_key.encode(cls._utf8)).hexdigest()
-                result = yield from RedisCache.hmget([digest_key], name_space)
-                if result and len(result) > 0 and result[0]:
-                    return json.loads(result[0].decode(cls._utf8))
-                else:
-                    result = yield from func(*args, **kwargs)
-                    yield from RedisCache.hmset(digest_key, json.dumps(result), name_space)
+            async def apply_cache(*args, **kwargs):
+                digest_key = digest(func_name, args[1:], kwargs, allowed)
+                if l1 is not None:
+                    result = l1.get(digest_key)
+                    if result is not missing:
+                        return result
+                result = await coalesced_get(key_prefix + digest_key)
+                if result:
+                    result = loads(result)
+                    if l1 is not None:
+                        l1.put(digest_key, result)
                     return result
-            return redis_check
+                if is_coroutine:
+                    result = await _func(*args, **kwargs)
+                else:
+                    result = func(*args, **kwargs)
+                write_behind(set_key(digest_key, dumps(result), name_space, expire_time))
+                return result
+            return apply_cache
         return wrapped
 
-    @classmethod
-    def redis_cache_decorator(cls, name_space='', expire_time=0):
+    def asyncio_redis_decorator(self, name_space=''):
         def wrapped(func):
+            func = types.coroutine(func)
+            func_name = func.__qualname__.encode()
+            dumps, loads, digest, write_behind = _dumps, _loads, _call_digest, _write_behind
+            hget, hset = self.hget, self.hset
+
             @wraps(func)
-            def apply_cache(*args, **kwargs):
-                _args = ''
-                if args and len(args) > 0:
-                    new_args = []
-                    for arg in args[1:]:
-                        if isinstance(arg, dict):
-                            new_args.append(json.dumps(arg, sort_keys=True))
-                        else:
-                            new_args.append(arg)
-                    _args = str(new_args)
-                redis_key = json.dumps({'func': func.__name__, 'args': _args, 'kwargs': kwargs}, sort_keys=True)
-                digest_key = hashlib.md5(redis_key.encode(cls._utf8)).hexdigest()
-                result = yield from RedisCache.get_key(digest_key, name_space)
+            async def redis_check(*args, **kwargs):
+                digest_key = digest(func_name, args[1:], kwargs)
+                result = await hget(digest_key, name_space)
                 if result:
-                    return json.loads(result)
-                result = yield from func(*args, **kwargs)
-                yield from RedisCache.set_key(digest_key, json.dumps(result), name_space, expire_time)
+                    return loads(result)
+                result = await func(*args, **kwargs)
+                write_behind(hset(digest_key, dumps(result), name_space))
                 return result
-            return apply_cache
+            return redis_check
         return wrapped
 
-    @classmethod
-    @coroutine
-    def run_lua(cls, script: str, keys: list, args: list = None, namespace=None):
+    def redis_cache_decorator(self, name_space='', expire_time=0, l1_size=0):
+        return self._cache_decorator(name_space, expire_time, l1_size, None, False)
+
+    async def run_lua(self, script: str, keys: list, args: list = None, namespace=None):
         args = args or []
-        with (yield from cls.get_pool()) as redis:
-            if script:
-                if namespace:
-                    keys = [cls._get_key(namespace, key) for key in keys]
-                return (yield from redis.eval(script=script, keys=keys, args=args))
-            return None
+        if script:
+            if namespace:
+                keys = [self._get_key(namespace, key) for key in keys]
+            async with self._conn() as redis:
+                return await redis.eval(script=script, keys=keys, args=args)
+        return None
 
-    @classmethod
-    @coroutine
-    def scan(cls, pattern_str: str, scan_top_records=10000):
+    async def scan(self, pattern_str: str, scan_top_records=10000):
         """
         Function to get all keys using scan in redis matching to pattern_str
         :param pattern_str: keys pattern
         :return: list of all redis keys available in top scan_top_records (default 10000) records
         """
         if pattern_str:
-            with (yield from cls.get_pool()) as redis:
-                return (yield from redis.scan(cursor=0, match=pattern_str, count=scan_top_records))
+            async with self._conn() as redis:
+                return await redis.scan(cursor=0, match=pattern_str, count=scan_top_records)
         return []
 
-    @classmethod
-    @coroutine
-    def keys(cls, pattern_str:str):
+    async def keys(self, pattern_str:str):
         """
         Function to get all keys in redis matching to pattern_str
         :param pattern_str: keys pattern
         :return: list of redis keys
         """
         if pattern_str:
-            with (yield from cls.get_pool()) as redis:
-                return (yield from redis.keys(pattern_str))
+            async with self._conn() as redis:
+                return await redis.keys(pattern_str)
         return []
 
-    @classmethod
-    def redis_cache_decorator_v2(cls, name_space='', expire_time=0):
-        def wrapped(func):
-            @wraps(func)
-            def apply_cache(*args, **kwargs):
-                _args = ''
-                if args and len(args) > 0:
-                    new_args = []
-                    for arg in args[1:]:
-                        if type(arg) in allowed_types_for_caching:
-                            if isinstance(arg, dict):
-                                new_args.append(json.dumps(arg, sort_keys=True))
-                            else:
-                                new_args.append(arg)
-                    _args = str(new_args)
-                _kwargs = {}
-                for key in kwargs:
-                    if type(kwargs[key]) in allowed_types_for_caching:
-                        _kwargs[key]= kwargs[key]
-
-                redis_key = json.dumps({'func': func.__name__, 'args': _args, 'kwargs': _kwargs}, sort_keys=True)
-                digest_key = hashlib.md5(redis_key.encode(cls._utf8)).hexdigest()
-                result = yield from RedisCache.get_key(digest_key, name_space)
-                if result:
-                    return json.loads(result)
-                if inspect.isgeneratorfunction(func):
-                    result = yield from func(*args, **kwargs)
-                else:
-                    result = func(*args, **kwargs)
-                yield from RedisCache.set_key(digest_key, json.dumps(result), name_space, expire_time)
-                return result
-
-            return apply_cache
-
-        return wrapped
-
-    @classmethod
-    @coroutine
-    def lpush(cls, namespace, key, value, *values):
-        key = cls._get_key(namespace, key)
-        with (yield from cls.get_pool()) as redis:
-            return (yield from redis.lpush(key, value, *values))
-
-    @classmethod
-    @coroutine
-    def llen(cls, namespace, key):
-        key = cls._get_key(namespace, key)
-        with (yield from cls.get_pool()) as redis:
-            return (yield from redis.llen(key))
-
-    @classmethod
-    @coroutine
-    def lrange(cls, namespace, key, start, stop):
-        key = cls._get_key(namespace, key)
-        with (yield from cls.get_pool()) as redis:
-            return (yield from redis.lrange(key, start, stop))
+    def redis_cache_decorator_v2(self, name_space='', expire_time=0, l1_size=0):
+        return self._cache_decorator(name_space, expire_time, l1_size, allowed_types_for_caching, True)
 
-    @classmethod
-    @coroutine
-    def zadd(cls, key, score, member, namespace=None, *pairs):
-      with (yield from cls.get_pool()) as redis:
+    async def zadd(self, key, score, member, namespace=None, *pairs):
         if namespace is not None:
-          key = cls._get_key(namespace, key)
-      return (yield from redis.zadd(key, score, member, *pairs))
+            key = self._get_key(namespace, key)
+        async with self._conn() as redis:
+            return await redis.zadd(key, score, member, *pairs)
 
-    @classmethod
-    @coroutine
-    def zrange(cls, key, start, stop, withscores=False, namespace=None):
+    async def zrange(self, key, start, stop, withscores=False, namespace=None):
         if namespace is not None:
-          key = cls._get_key(namespace, key)
-        with (yield from cls.get_pool()) as redis:
-            return (yield from redis.zrange(key, start, stop, withscores))
+            key = self._get_key(namespace, key)
+        async with self._conn() as redis:
+            return await redis.zrange(key, start, stop, withscores)
 
-    @classmethod
-    @coroutine
-    def zrangebyscore(cls, key, namespace=None, min=float('-inf'), max=float('inf'), withscores=False, offset=None, count=None):
+    async def zrangebyscore(self, key, namespace=None, min=float('-inf'), max=float('inf'), withscores=False, offset=None, count=None):
         if namespace is not None:
-          key = cls._get_key(namespace, key)
-        with (yield from cls.get_pool()) as redis:
-            return (yield from redis.zrangebyscore(key, min, max, withscores, offset, count))
+            key = self._get_key(namespace, key)
+        async with self._conn() as redis:
+            return await redis.zrangebyscore(key, min, max, withscores, offset, count)
 
-    @classmethod
-    @coroutine
-    def zrem(cls, key,  member, namespace=None, *members):
+    async def zrem(self, key,  member, namespace=None, *members):
         if namespace is not None:
-          key = cls._get_key(namespace, key)
-        with (yield from cls.get_pool()) as redis:
-            return (yield from redis.zrem(key, member, *members))
+            key = self._get_key(namespace, key)
+        async with self._conn() as redis:
+            return await redis.zrem(key, member, *members)
 
-    @classmethod
-    @coroutine
-    def zremrangebyscore(cls, key, namespace=None, min=float('-inf'), max=float('inf'), exclude=None):
+    async def zremrangebyscore(self, key, namespace=None, min=float('-inf'), max=float('inf'), exclude=None):
         if namespace is not None:
-          key = cls._get_key(namespace, key)
-        with (yield from cls.get_pool()) as redis:
-            return (yield from redis.zremrangebyscore(key, min, max, exclude))
+            key = self._get_key(namespace, key)
+        async with self._conn() as redis:
+            return await redis.zremrangebyscore(key, min, max, exclude)
 
-class RedisCacheV2:
-    _utf8 = 'utf-8'
 
-    def __init__(self, host, port, minsize=5, maxsize=10):
-        self._host = host
-        self._port = port
-        self._minsize = minsize
-        self._maxsize = maxsize
-        self._lock = asyncio.Semaphore(1)
-        self._pool = None
+def _class_level(cls):
+    """
+    Class decorator that rebinds the _RedisOps methods as classmethods, for caches that are used through the class
+    """
+    for name, member in vars(_RedisOps).items():
+        if inspect.isfunction(member) and not name.startswith('__') and name not in vars(cls):
+            setattr(cls, name, classmethod(member))
+    return cls
+
 
-    @coroutine
-    def get_pool(self):
-        if not self._pool:
-            with (yield from self._lock):
-                if not self._pool:
-                    self._pool = yield from aioredis.create_pool((self._host, self._port), minsize=self._minsize,
-                                                                 maxsize=self._maxsize)
-        return (yield from self._pool)
-
-    @coroutine
-    def set_key(self, key, value, namespace=None, expire=0):
+@_class_level
+class RedisCache(_RedisOps):
+    _pool = None
+    _host = None
+    _port = None
+    _minsize = None
+    _maxsize = None
+    _lock = None
+    _get_batcher = None
+
+    @classmethod
+    def connect_v2(cls, host, port, minsize=None, maxsize=None, loop=None, pool_size=None):
         """
-        Set a key in a cache.
-        :param key: Key name
-        :param value: Value
-        :param namespace : Namespace to associate the key with
-        :param expire: expiration
-        :return:
+        Setup a connection pool params
+        :param host: Redis host
+        :param port: Redis port
+        :param minsize: Minimum pool size, defaults to REDIS_POOL_MIN or 10
+        :param maxsize: Maximum pool size, defaults to REDIS_POOL_MAX or 50
+        :param loop: Event loop
+        :param pool_size: Fixed pool size, overrides minsize and maxsize
         """
-        with (yield from self.get_pool()) as redis:
-            if namespace is not None:
-                key = self._get_key(namespace, key)
-            yield from redis.set(key, value, expire=expire)
+        cls._host = host
+        cls._port = port
+        cls._minsize, cls._maxsize = _pool_bounds(minsize, maxsize, pool_size)
 
-    @coroutine
-    def increment_value(self, key, namespace=None):
-        # Set a redis key and increment the value by one
-        with (yield from self.get_pool()) as redis:
-            if namespace is not None:
-                key = self._get_key(namespace, key)
-            yield from redis.incr(key)
-
-    @coroutine
-    def increment_by_value(self, key, value: int, namespace=None):
-        with (yield from self.get_pool()) as redis:
-            if namespace is not None:
-                key = self._get_key(namespace, key)
-            yield from redis.incrby(key, value)
-
-    @coroutine
-    def set_key_if_not_exists(self, key, value, namespace=None, expire=0):
+    @classmethod
+    async def connect(cls, host, port, minsize=None, maxsize=None, loop=None, pool_size=None):
         """
-        Set a redis key and return True if the key does not exists else return False
-        :param key: Key name
-        :param value: Value
-        :param namespace : Namespace to associate the key with
-        :param expire: expiration
-        :return:
+        Setup a connection pool
+        :param host: Redis host
+        :param port: Redis port
+        :param minsize: Minimum pool size, defaults to REDIS_POOL_MIN or 10
+        :param maxsize: Maximum pool size, defaults to REDIS_POOL_MAX or 50
+        :param loop: Event loop, defaults to the loop connect is awaited on
+        :param pool_size: Fixed pool size, overrides minsize and maxsize
         """
-        with (yield from self.get_pool()) as redis:
-            if namespace:
-                key = self._get_key(namespace, key)
-            return (yield from redis.set(key, value, expire=expire, exist='SET_IF_NOT_EXIST'))
-
-    @coroutine
-    def get_key(self, key, namespace=None):
-        with (yield from self.get_pool()) as redis:
-            if namespace is not None:
-                key = self._get_key(namespace, key)
-            return (yield from redis.get(key, encoding=self._utf8))
-
-    @coroutine
-    def mset(self, *pairs):
-        with (yield from self.get_pool()) as redis:
-            return (yield from redis.mset(*pairs))
-
-    @coroutine
-    def mget(self, *keys):
-        with (yield from self.get_pool()) as redis:
-            return (yield from redis.mget(*keys, encoding=self._utf8))
-
-    @coroutine
-    def hmget(self, fields, namespace=''):
-        with (yield from self.get_pool()) as redis:
-            return (yield from redis.hmget(namespace, *fields))
-
-    @coroutine
-    def hmset(self, field, value, namespace=''):
-        with (yield from self.get_pool()) as redis:
-            yield from redis.hmset(namespace, field, value)
-
-    @coroutine
-    def delete(self, key, namespace=None):
-        with (yield from self.get_pool()) as redis:
-            if namespace is not None:
-                key = self._get_key(namespace, key)
-            yield from redis.delete(key)
-
-    @coroutine
-    def delete_keys(self, *keys, namespace=None):
-        with (yield from self.get_pool()) as redis:
-            if namespace is not None:
-                keys = [self._get_key(namespace, key) for key in keys]
-            yield from redis.delete(*keys)
+        minsize, maxsize = _pool_bounds(minsize, maxsize, pool_size)
+        cls._pool = await aioredis.create_pool((host, port), minsize=minsize, maxsize=maxsize, loop=loop)
 
-    def hdel(self, key, namespace):
-        with (yield from self.get_pool()) as redis:
-            if namespace is not None:
-                yield from redis.hdel(namespace, key)
+    @classmethod
+    async def lpush(cls, namespace, key, value, *values):
+        key = cls._get_key(namespace, key)
+        async with cls._conn() as redis:
+            return await redis.lpush(key, value, *values)
 
-    def hgetall(self, namespace):
-        with (yield from self.get_pool()) as redis:
-            if namespace is not None:
-                return (yield from redis.hgetall(namespace, encoding=self._utf8))
+    @classmethod
+    async def llen(cls, namespace, key):
+        key = cls._get_key(namespace, key)
+        async with cls._conn() as redis:
+            return await redis.llen(key)
 
-    @coroutine
-    def lpush(self, key, value, *values, namespace=None):
+    @classmethod
+    async def lrange(cls, namespace, key, start, stop):
+        key = cls._get_key(namespace, key)
+        async with cls._conn() as redis:
+            return await redis.lrange(key, start, stop)
+
+
+class RedisCacheV2(_RedisOps):
+    def __init__(self, host, port, minsize=None, maxsize=None, pool_size=None):
+        self._host = host
+        self._port = port
+        self._minsize, self._maxsize = _pool_bounds(minsize, maxsize, pool_size)
+        self._lock = None
+        self._pool = None
+        self._get_batcher = None
+
+    async def lpush(self, key, value, *values, namespace=None):
         if namespace:
             key = self._get_key(namespace, key)
-        with (yield from self.get_pool()) as redis:
-            return (yield from redis.lpush(key, value, *values))
+        async with self._conn() as redis:
+            return await redis.lpush(key, value, *values)
 
-    @coroutine
-    def llen(self, key, namespace=None):
+    async def llen(self, key, namespace=None):
         if namespace:
             key = self._get_key(namespace, key)
-        with (yield from self.get_pool()) as redis:
-            return (yield from redis.llen(key))
+        async with self._conn() as redis:
+            return await redis.llen(key)
 
-    @coroutine
-    def lrange(self, key, start, stop, namespace=None):
+    async def lrange(self, key, start, stop, namespace=None):
         if namespace:
             key = self._get_key(namespace, key)
-        with (yield from self.get_pool()) as redis:
-            return (yield from redis.lrange(key, start, stop))
-
-    @coroutine
-    def clear_namespace(self, namespace) -> int:
-        pattern = namespace + '*'
-        return (yield from self._delete_by_pattern(pattern))
-
-    @coroutine
-    def _delete_by_pattern(self, pattern: str) -> int:
-        if not pattern:
-            return 0
-        with (yield from self.get_pool()) as redis:
-            _keys = yield from redis.keys(pattern)
-            if _keys:
-                yield from redis.delete(*_keys)
-        return len(_keys)
-
-    @coroutine
-    def delete_by_prefix(self, prefix, namespace=None):
-        prefix_with_namespace = self._get_key(namespace, prefix) if namespace else prefix
-        pattern = '{}*'.format(prefix_with_namespace)
-        return (yield from self._delete_by_pattern(pattern))
-
-    @coroutine
-    def exit(self):
-        if self._pool:
-            yield from self._pool.clear()
-
-    @staticmethod
-    def _get_key(namespace, key):
-        return namespace + ':' + key
-
-    def asyncio_redis_decorator(self, name_space=''):
-        def wrapped(func):
-            @wraps(func)
-            def redis_check(*args, **kwargs):
-                _args = ''
-                if args and len(args) > 0:
-                    new_args = []
-                    for arg in args[1:]:
-                        if isinstance(arg, dict):
-                            new_args.append(json.dumps(arg, sort_keys=True))
-                        else:
-                            new_args.append(arg)
-                    _args = str(new_args)
-                redis_key = json.dumps({'func': func.__name__, 'args': _args, 'kwargs': kwargs}, sort_keys=True)
-                digest_key = hashlib.md5(redis_key.encode(self._utf8)).hexdigest()
-                result = yield from self.hmget([digest_key], name_space)
-                if result and len(result) > 0 and result[0]:
-                    return json.loads(result[0].decode(self._utf8))
-                else:
-                    result = yield from func(*args, **kwargs)
-                    yield from self.hmset(digest_key, json.dumps(result), name_space)
-                    return result
-
-            return redis_check
-
-        return wrapped
-
-    def redis_cache_decorator(self, name_space='', expire_time=0):
-        def wrapped(func):
-            @wraps(func)
-            def apply_cache(*args, **kwargs):
-                _args = ''
-                if args and len(args) > 0:
-                    new_args = []
-                    for arg in args[1:]:
-                        if isinstance(arg, dict):
-                            new_args.append(json.dumps(arg, sort_keys=True))
-                        else:
-                            new_args.append(arg)
-                    _args = str(new_args)
-                redis_key = json.dumps({'func': func.__name__, 'args': _args, 'kwargs': kwargs}, sort_keys=True)
-                digest_key = hashlib.md5(redis_key.encode(self._utf8)).hexdigest()
-                result = yield from self.get_key(digest_key, name_space)
-                if result:
-                    return json.loads(result)
-                result = yield from func(*args, **kwargs)
-                yield from self.set_key(digest_key, json.dumps(result), name_space, expire_time)
-                return result
-
-            return apply_cache
-
-        return wrapped
-
-    @coroutine
-    def run_lua(self, script: str, keys: list, args: list = None, namespace=None):
-        args = args or []
-        with (yield from self.get_pool()) as redis:
-            if script:
-                if namespace:
-                    keys = [self._get_key(namespace, key) for key in keys]
-                return (yield from redis.eval(script=script, keys=keys, args=args))
-            return None
-
-    @classmethod
-    @coroutine
-    def scan(cls, pattern_str: str, scan_top_records=10000):
-        """
-        Function to get all keys using scan in redis matching to pattern_str
-        :param pattern_str: keys pattern
-        :return: list of all redis keys available in top scan_top_records (default 10000) records
-        """
-        if pattern_str:
-            with (yield from cls.get_pool()) as redis:
-                return (yield from redis.scan(cursor=0, match=pattern_str, count=scan_top_records))
-        return []
-
-
-    @coroutine
-    def keys(self, pattern_str: str):
-        """
-        Function to get all keys in redis matching to pattern_str
-        :param pattern_str: keys pattern
-        :return: list of redis keys
-        """
-        if pattern_str:
-            with (yield from self.get_pool()) as redis:
-                return (yield from redis.keys(pattern_str))
-        return []
-
-    def redis_cache_decorator_v2(self, name_space='', expire_time=0):
-        def wrapped(func):
-            @wraps(func)
-            def apply_cache(*args, **kwargs):
-                _args = ''
-                if args and len(args) > 0:
-                    new_args = []
-                    for arg in args[1:]:
-                        if type(arg) in allowed_types_for_caching:
-                            if isinstance(arg, dict):
-                                new_args.append(json.dumps(arg, sort_keys=True))
-                            else:
-                                new_args.append(arg)
-                    _args = str(new_args)
-                _kwargs = {}
-                for key in kwargs:
-                    if type(kwargs[key]) in allowed_types_for_caching:
-                        _kwargs[key] = kwargs[key]
-
-                redis_key = json.dumps({'func': func.__name__, 'args': _args, 'kwargs': _kwargs}, sort_keys=True)
-                digest_key = hashlib.md5(redis_key.encode(self._utf8)).hexdigest()
-                result = yield from self.get_key(digest_key, name_space)
-                if result:
-                    return json.loads(result)
-                result = yield from func(*args, **kwargs)
-                yield from self.set_key(digest_key, json.dumps(result), name_space, expire_time)
-                return result
-
-            return apply_cache
-
-        return wrapped
+        async with self._conn() as redis:
+            return await redis.lrange(key, start, stop)
@@ -1,17 +1,29 @@
-from asyncio import coroutine
 from contextlib import contextmanager
-from functools import wraps
+from functools import wraps, lru_cache
 from enum import Enum
 import aiopg
 import asyncio
+import datetime
+import decimal
+import json
 import logging
+import os
+import types
+import uuid
+import weakref
 
 from aiopg import create_pool, Pool, Cursor
 
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+logger = logging.getLogger(__name__)
 
 _CursorType = Enum('CursorType', 'PLAIN, DICT, NAMEDTUPLE')
 
+_UNSET = object()
+
 USE_REPLICA = 'use_replica'
 def dict_cursor(func):
     """
@@ -27,10 +39,13 @@ def dict_cursor(func):
         A client-side dictionary cursor
     """
 
+    # generator based functions are wrapped so that they can still be awaited
+    func = types.coroutine(func)
+
     @wraps(func)
-    def wrapper(cls, *args, **kwargs):
-        with (yield from cls.get_cursor(_CursorType.DICT)) as c:
-            return (yield from func(cls, c, *args, **kwargs))
+    async def wrapper(cls, *args, **kwargs):
+        with (await cls.get_cursor(_CursorType.DICT)) as c:
+            return await func(cls, c, *args, **kwargs)
 
     return wrapper
 
@@ -49,10 +64,12 @@ def cursor(func):
         A client-side cursor
     """
 
+    func = types.coroutine(func)
+
     @wraps(func)
-    def wrapper(cls, *args, **kwargs):
-        with (yield from cls.get_cursor(use_replica=kwargs.get(USE_REPLICA))) as c:
-            return (yield from func(cls, c, *args, **kwargs))
+    async def wrapper(cls, *args, **kwargs):
+        with (await cls.get_cursor(use_replica=kwargs.get(USE_REPLICA))) as c:
+            return await func(cls, c, *args, **kwargs)
 
     return wrapper
 
@@ -71,10 +88,12 @@ def nt_cursor(func):
         A client-side namedtuple cursor
     """
 
+    func = types.coroutine(func)
+
     @wraps(func)
-    def wrapper(cls, *args, **kwargs):
-        with (yield from cls.get_cursor(_CursorType.NAMEDTUPLE, kwargs.get(USE_REPLICA))) as c:
-            return (yield from func(cls, c, *args, **kwargs))
+    async def wrapper(cls, *args, **kwargs):
+        with (await cls.get_cursor(_CursorType.NAMEDTUPLE, kwargs.get(USE_REPLICA))) as c:
+            return await func(cls, c, *args, **kwargs)
 
     return wrapper
 
@@ -92,17 +111,20 @@ def transaction(func):
         A client-side transacted named cursor
     """
 
+    func = types.coroutine(func)
+
     @wraps(func)
-    def wrapper(cls, *args, **kwargs):
-        with (yield from cls.get_cursor(_CursorType.NAMEDTUPLE)) as c:
+    async def wrapper(cls, *args, **kwargs):
+        with (await cls.get_cursor(_CursorType.NAMEDTUPLE)) as c:
+            # aiopg connections are always in autocommit mode, so the transaction has to be opened explicitly
             try:
-                yield from c.execute('BEGIN')
-                result = (yield from func(cls, c, *args, **kwargs))
-            except Exception as e:
-                yield from c.execute('ROLLBACK')
-                raise e
+                await c.execute('BEGIN')
+                result = await func(cls, c, *args, **kwargs)
+            except BaseException:
+                await _rollback(c)
+                raise
             else:
-                yield from c.execute('COMMIT')
+                await c.execute('COMMIT')
                 return result
 
     return wrapper
@@ -114,47 +136,44 @@ class PostgresStore:
     _replica_connection_params = {}
     _connection_params = {}
     _use_pool = None
-    _insert_string = "insert into {} ({}) values ({}) returning *;"
-    _bulk_insert_string = "insert into {} ({}) values"
-    _update_string = "update {} set ({}) = ({}) where ({}) returning *;"
-    _select_all_string_with_condition = "select * from {} where ({}) limit {} offset {};"
-    _select_all_string_with_condition_group = "select * from {} where ({})  group by {} limit {} offset {};"
-    _select_all_string = "select * from {} limit {} offset {};"
-    _select_selective_column = "select {} from {} limit {} offset {};"
-    _select_selective_column_group = "select {} from {}  group by {} limit {} offset {};"
-    _select_selective_column_with_condition = "select {} from {} where ({}) limit {} offset {};"
-    _select_selective_column_with_condition_group  = "select {} from {} where ({}) group by {} limit {} offset {};"
-    _select_all_string_with_condition_and_order_by = "select * from {} where ({}) order by {} limit {} offset {};"
-    _select_all_string_with_condition_and_order_by_group = "select * from {} where ({}) group by {} order by {} limit {} offset {};"
-    _select_all_string_with_order_by = "select * from {} order by {} limit {} offset {};"
-    _select_selective_column_with_order_by = "select {} from {} order by {} limit {} offset {};"
-    _select_selective_column_with_order_by_group = "select {} from {}  group by {} order by {} limit {} offset {};"
-    _select_selective_column_with_condition_and_order_by = "select {} from {} where ({}) order by {} limit {} offset {};"
-    _select_selective_column_with_condition_and_order_by_group = "select {} from {} where ({}) group by {} order by {} limit {} offset {};"
-    _delete_query = "delete from {} where ({});"
-    _count_query = "select count(*) from {};"
-    _count_query_where = "select count(*) from {} where {};"
+    _dsn = None
+    _replica_dsn = None
+    _connect_options = {}
+    _cleanser_task = None
+    _replica_cleanser_task = None
+    _approx_count_query = "select reltuples::bigint from pg_class where oid = to_regclass(%s);"
     _OR = ' or '
     _AND = ' and '
     _LPAREN = '('
     _RPAREN = ')'
     _WHERE_AND = '{} {} %s'
-    _PLACEHOLDER = ' %s,'
-    _COMMA = ', '
-    _pool_pending = asyncio.Semaphore(1)
-    _replica_pool_pending = asyncio.Semaphore(1)
-    _return_val = ' returning *;'
+    _pool_pending = None
+    _replica_pool_pending = None
+    _prepared = weakref.WeakKeyDictionary()
+    _declare_stream = "declare cauldron_stream no scroll cursor for "
+    _fetch_stream = "fetch {} from cauldron_stream;"
+    _pool_only_params = ('minsize', 'maxsize', 'echo', 'pool_recycle', 'on_connect')
+    _connect_only_params = ('timeout', 'enable_json', 'enable_hstore', 'enable_uuid')
+    _CURSOR_FACTORIES = {_CursorType.PLAIN: None,
+                         _CursorType.NAMEDTUPLE: psycopg2.extras.NamedTupleCursor,
+                         _CursorType.DICT: psycopg2.extras.DictCursor}
 
     @classmethod
     def connect(cls, database: str, user: str, password: str, host: str, port: int, *, use_pool: bool=True,
-                enable_ssl: bool=False, minsize=1, maxsize=10, keepalives_idle=5, keepalives_interval=4, echo=False,
+                enable_ssl: bool=False, minsize=None, maxsize=10, keepalives_idle=5, keepalives_interval=4, echo=False,
                 refresh_period=-1, replicahost='',
                 **kwargs):
         """
         Sets connection parameters
         For more information on the parameters that is accepts,
         see : http://www.postgresql.org/docs/9.2/static/libpq-connect.html
+
+        minsize connections are opened as soon as the pool is created (and again after every periodic
+        cleanse) so that queries do not wait on the connection handshake, at the cost of holding those
+        connections open on the server. It defaults to the number of CPUs, at least 2 and at most maxsize.
         """
+        if minsize is None:
+            minsize = min(maxsize, max(2, os.cpu_count() or 1))
         cls._connection_params['database'] = database
         cls._connection_params['user'] = user
         cls._connection_params['password'] = password
@@ -169,6 +188,8 @@ class PostgresStore:
         cls._connection_params.update(kwargs)
         cls._use_pool = use_pool
         cls.refresh_period = refresh_period
+        if not use_pool:
+            cls._dsn, cls._connect_options = cls._make_dsn(cls._connection_params)
         
         if replicahost:
             cls._replica_connection_params['database'] = database
@@ -183,6 +204,24 @@ class PostgresStore:
             cls._replica_connection_params['keepalives_interval'] = keepalives_interval
             cls._replica_connection_params['echo'] = echo
             cls._replica_connection_params.update(kwargs)
+            if not use_pool:
+                cls._replica_dsn, _ = cls._make_dsn(cls._replica_connection_params)
+
+    @classmethod
+    def _make_dsn(cls, connection_params):
+        """
+        Splits the connection parameters for aiopg.connect, leaving out the ones only the pool understands
+
+        Returns:
+            a libpq DSN with every libpq parameter quoted, and the aiopg options to pass as keyword arguments
+        """
+        dsn_params, options = {}, {}
+        for key, value in connection_params.items():
+            if key in cls._connect_only_params:
+                options[key] = value
+            elif key not in cls._pool_only_params:
+                dsn_params[key] = value
+        return psycopg2.extensions.make_dsn(**dsn_params), options
 
     @classmethod
     def use_pool(cls, pool: Pool):
@@ -192,25 +231,44 @@ class PostgresStore:
         cls._pool = pool
 
     @classmethod
-    @coroutine
-    def _get_pool(cls, _conn_params, _conn_pool_pending, _pool, _is_replica):
+    def _lock(cls, name):
+        """
+        Returns the lock stored in the class attribute name, creating it on first use
+        so that it is bound to the running event loop rather than the one current at import time
+        """
+        lock = getattr(cls, name)
+        if lock is None:
+            lock = asyncio.Lock()
+            setattr(cls, name, lock)
+        return lock
+
+    @classmethod
+    async def _get_pool(cls, _conn_params, _conn_pool_pending, _pool_attr, _is_replica):
         """
         Yields:
             existing db connection pool
         """
+        _pool = getattr(cls, _pool_attr)
+        if _pool:
+            return _pool
         if len(_conn_params) < 5:
             raise ConnectionError('Please call SQLStore.connect before calling this method')
-        if not _pool:
-            with (yield from _conn_pool_pending):
-                if not _pool:
-                    _pool = yield from create_pool(**_conn_params)
-                    asyncio.async(cls._periodic_cleansing(_is_replica))
-                    
+        async with cls._lock(_conn_pool_pending):
+            # another coroutine may have created the pool while this one waited on the lock
+            _pool = getattr(cls, _pool_attr)
+            if not _pool:
+                _pool = await create_pool(**_conn_params)
+                setattr(cls, _pool_attr, _pool)
+                if cls.refresh_period > 0:
+                    task = asyncio.ensure_future(cls._periodic_cleansing(_is_replica))
+                    if _is_replica:
+                        cls._replica_cleanser_task = task
+                    else:
+                        cls._cleanser_task = task
         return _pool
-    
+
     @classmethod
-    @coroutine
-    def get_pool(cls, _use_replica=False):
+    async def get_pool(cls, _use_replica=False):
         """
         :param cls:
         :param _use_replica:
@@ -218,85 +276,153 @@ class PostgresStore:
         """
 
         if _use_replica:
-            cls._replica_pool = yield from  cls._get_pool(cls._replica_connection_params, cls._replica_pool_pending, cls._replica_pool, _use_replica)
-            return cls._replica_pool
-        else:
-            cls._pool = yield from cls._get_pool(cls._connection_params, cls._pool_pending, cls._pool, _use_replica)
-            return cls._pool
+            return await cls._get_pool(cls._replica_connection_params, '_replica_pool_pending', '_replica_pool', True)
+        return await cls._get_pool(cls._connection_params, '_pool_pending', '_pool', False)
 
     @classmethod
-    @coroutine
-    def _periodic_cleansing(cls, _is_replica):
+    async def _periodic_cleansing(cls, _is_replica):
         """
         Periodically cleanses idle connections in pool
         """
-        if cls.refresh_period > 0:
-            yield from asyncio.sleep(cls.refresh_period * 60)
-            logging.getLogger().info("Clearing unused DB connections")
-            if _is_replica:
-                yield from cls._replica_pool.clear()
-            else:
-                yield from cls._pool.clear()
-            asyncio.async(cls._periodic_cleansing(_is_replica))
+        while cls.refresh_period > 0:
+            await asyncio.sleep(cls.refresh_period * 60)
+            logger.info("Clearing unused DB connections")
+            _pool = cls._replica_pool if _is_replica else cls._pool
+            await _pool.clear()
+            await cls._warm_up(_pool)
 
+    @classmethod
+    async def shutdown(cls):
+        """
+        Stops the periodic cleansing and closes the connection pools
+        """
+        for task in (cls._cleanser_task, cls._replica_cleanser_task):
+            if task is not None:
+                task.cancel()
+        cls._cleanser_task = cls._replica_cleanser_task = None
+        for _pool in (cls._pool, cls._replica_pool):
+            if _pool is not None:
+                _pool.close()
+                await _pool.wait_closed()
+        cls._pool = cls._replica_pool = None
+
+    @staticmethod
+    async def _warm_up(pool: Pool):
+        """
+        Refills the pool to minsize so that the next queries do not pay for the handshake.
+        aiopg tops the pool up to minsize on every acquire, so a single acquire and release is enough
+        """
+        try:
+            conn = await pool.acquire()
+            pool.release(conn)
+        except Exception:
+            logger.exception("Failed to warm up DB connections")
 
     @classmethod
-    @coroutine
-    def get_cursor(cls, cursor_type=_CursorType.PLAIN, use_replica=False) -> Cursor:
+    async def get_cursor(cls, cursor_type=_CursorType.PLAIN, use_replica=False) -> Cursor:
         """
         Yields:
             new client-side cursor from existing db connection pool
         """
         if cls._use_pool:
-            _connection_source = yield from cls.get_pool(use_replica)
+            _connection_source = await cls.get_pool(use_replica)
         else:
-            if use_replica:
-                _connection_source = yield from aiopg.connect(echo=False, **cls_replica_connection_params)
-            else:
-                _connection_source = yield from aiopg.connect(echo=False, **cls._connection_params)
+            _connection_source = await aiopg.connect(cls._replica_dsn if use_replica else cls._dsn, echo=False,
+                                                     **cls._connect_options)
 
-        if cursor_type == _CursorType.PLAIN:
-            _cur = yield from _connection_source.cursor()
-        if cursor_type == _CursorType.NAMEDTUPLE:
-            _cur = yield from _connection_source.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
-        if cursor_type == _CursorType.DICT:
-            _cur = yield from _connection_source.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        _cur = await _connection_source.cursor(cursor_factory=cls._CURSOR_FACTORIES[cursor_type])
 
         if not cls._use_pool:
             _cur = cursor_context_manager(_connection_source, _cur)
 
         return _cur
 
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _build_count_sql(table, where_clause):
+        if where_clause:
+            return f"select count(*) from {table} where {where_clause};"
+        return f"select count(*) from {table};"
+
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _build_insert_sql(table, keys):
+        return f"insert into {table} ({', '.join(keys)}) values ({_placeholders(len(keys))}) returning *;"
+
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _build_bulk_insert_sql(table, keys):
+        """
+        Returns:
+            the statement prefix and the placeholder group for a single row
+        """
+        return f"insert into {table} ({', '.join(keys)}) values ", f"({_placeholders(len(keys))})"
+
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _build_json_bulk_insert_sql(table, keys):
+        columns = ', '.join(keys)
+        return f"insert into {table} ({columns}) select {columns} " \
+               f"from json_populate_recordset(null::{table}, %s) returning *;"
+
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _build_update_sql(table, keys, where_clause):
+        return f"update {table} set ({', '.join(keys)}) = ({_placeholders(len(keys))}) " \
+               f"where ({where_clause}) returning *;"
+
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _build_delete_sql(table, where_clause):
+        return f"delete from {table} where ({where_clause});"
+
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _build_select_sql(table, columns, where_clause, order_by, group_by):
+        """
+        Builds a select statement for a query shape
+        limit and offset are left as placeholders so that they do not change the shape
+        """
+        query = f"select {', '.join(columns) if columns else '*'} from {table}"
+        if where_clause:
+            query += f" where ({where_clause})"
+        if group_by:
+            query += f" group by {group_by}"
+        if order_by:
+            query += f" order by {order_by}"
+        return query + " limit %s offset %s;"
+
     @classmethod
-    @coroutine
-    @cursor
-    def count(cls, cur, table:str, where_keys: list=None, use_replica=False):
+    async def count(cls, table:str, where_keys: list=None, use_replica=False, approx: bool=False):
         """
         gives the number of records in the table
 
         Args:
             table: a string indicating the name of the table
+            approx: return the planner's row estimate for the table instead of scanning it,
+                    ignored when where_keys are given or when the table has never been analyzed
 
         Returns:
             an integer indicating the number of records in the table
 
         """
-
+        if approx and not where_keys:
+            with (await cls.get_cursor(use_replica=use_replica)) as cur:
+                await cur.execute(cls._approx_count_query, (table,))
+                result = await cur.fetchone()
+            if result is not None and result[0] >= 0:
+                return int(result[0])
         if where_keys:
             where_clause, values = cls._get_where_clause_with_values(where_keys)
-            query = cls._count_query_where.format(table, where_clause)
-            q, t = query, values
         else:
-            query = cls._count_query.format(table)
-            q, t = query, ()
-        yield from cur.execute(q, t)
-        result = yield from cur.fetchone()
-        return int(result[0])
+            where_clause, values = None, ()
+        with (await cls.get_cursor(use_replica=use_replica)) as cur:
+            await cur.execute(cls._build_count_sql(table, where_clause), values)
+            result = await cur.fetchone()
+            return int(result[0])
 
     @classmethod
-    @coroutine
-    @nt_cursor
-    def insert(cls, cur, table: str, values: dict):
+    async def insert(cls, table: str, values: dict):
         """
         Creates an insert statement with only chosen fields
 
@@ -308,39 +434,40 @@ class PostgresStore:
             A 'Record' object with table columns as properties
 
         """
-        keys = cls._COMMA.join(values.keys())
-        value_place_holder = cls._PLACEHOLDER * len(values)
-        query = cls._insert_string.format(table, keys, value_place_holder[:-1])
-        yield from cur.execute(query, tuple(values.values()))
-        return (yield from cur.fetchone())
+        query = cls._build_insert_sql(table, tuple(values.keys()))
+        with (await cls.get_cursor(_CursorType.NAMEDTUPLE)) as cur:
+            await cur.execute(query, tuple(values.values()))
+            return await cur.fetchone()
 
     @classmethod
-    @coroutine
-    @nt_cursor
-    def bulk_insert(cls, cur, table: str, records: list):
+    async def bulk_insert(cls, table: str, records: list, as_json: bool=False):
         """
         Creates an insert statement with only chosen fields for a set of entries
 
         Args:
         table: a string indicating the name of the table
         records: A list of dictionaries consisting of all the records to be inserted
+        as_json: send all the records as a single json parameter that the server expands with
+                 json_populate_recordset, much cheaper to parse than a values list for thousands of rows.
+                 Only json types, datetimes, dates, times, UUIDs and Decimals are supported,
+                 anything else (e.g. bytes) raises TypeError
         :Returns:
            A set 'Record' objects with table columns as properties
         """
-        keys = cls._COMMA.join(records[0].keys())
-        value_ordered = list()
-        for record in records:
-            value_ordered.append([record[key] for key in records[0]])
-        value_place_holder = cls._LPAREN + (cls._PLACEHOLDER*len(records[0]))[:-1] + cls._RPAREN
-        values = ','.join((yield from cur.mogrify(value_place_holder, tuple(rec))).decode("utf-8") for rec in value_ordered)
-        yield from cur.execute(cls._bulk_insert_string.format(table, keys) + values + cls._return_val)
-        return (yield from cur.fetchall())
-
+        keys = tuple(records[0].keys())
+        if as_json:
+            query = cls._build_json_bulk_insert_sql(table, keys)
+            values = (json.dumps(records, default=_json_default),)
+        else:
+            values = [record[key] for record in records for key in keys]
+            query, value_place_holder = cls._build_bulk_insert_sql(table, keys)
+            query += ','.join([value_place_holder] * len(records)) + ' returning *;'
+        with (await cls.get_cursor(_CursorType.NAMEDTUPLE)) as cur:
+            await cur.execute(query, values)
+            return await cur.fetchall()
 
     @classmethod
-    @coroutine
-    @nt_cursor
-    def update(cls, cur, table: str, values: dict, where_keys: list) -> tuple:
+    async def update(cls, table: str, values: dict, where_keys: list) -> tuple:
         """
         Creates an update query with only chosen fields
         Supports only a single field where clause
@@ -357,28 +484,34 @@ class PostgresStore:
             an integer indicating count of rows deleted
 
         """
-        keys = cls._COMMA.join(values.keys())
-        value_place_holder = cls._PLACEHOLDER * len(values)
         where_clause, where_values = cls._get_where_clause_with_values(where_keys)
-        query = cls._update_string.format(table, keys, value_place_holder[:-1], where_clause)
-        yield from cur.execute(query, (tuple(values.values()) + where_values))
-        return (yield from cur.fetchall())
+        query = cls._build_update_sql(table, tuple(values.keys()), where_clause)
+        with (await cls.get_cursor(_CursorType.NAMEDTUPLE)) as cur:
+            await cur.execute(query, (tuple(values.values()) + where_values))
+            return await cur.fetchall()
 
     @classmethod
     def _get_where_clause_with_values(cls, where_keys):
-        values = []
+        # the shape (columns and operators, without the values) is hashable and keys the clause cache
+        shape, values = [], []
+        append_shape, extend_values = shape.append, values.extend
+        for ele in where_keys:
+            conditions = ele.values()
+            append_shape((tuple(ele), tuple([val[0] for val in conditions])))
+            extend_values([val[1] for val in conditions])
+        return cls._where_clause_for_shape(tuple(shape)), tuple(values)
 
-        def make_and_query(ele: dict):
-            and_query = cls._AND.join([cls._WHERE_AND.format(e[0], e[1][0]) for e in ele.items()])
-            values.extend([val[1] for val in ele.values()])
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def _where_clause_for_shape(cls, shape):
+        def make_and_query(keys, operators):
+            and_query = cls._AND.join([cls._WHERE_AND.format(key, operator) for key, operator in zip(keys, operators)])
             return cls._LPAREN + and_query + cls._RPAREN
 
-        return cls._OR.join(map(make_and_query, where_keys)), tuple(values)
+        return cls._OR.join([make_and_query(keys, operators) for keys, operators in shape])
 
     @classmethod
-    @coroutine
-    @cursor
-    def delete(cls, cur, table: str, where_keys: list):
+    async def delete(cls, table: str, where_keys: list):
         """
         Creates a delete query with where keys
         Supports multiple where clause with and or or both
@@ -395,15 +528,14 @@ class PostgresStore:
 
         """
         where_clause, values = cls._get_where_clause_with_values(where_keys)
-        query = cls._delete_query.format(table, where_clause)
-        yield from cur.execute(query, values)
-        return cur.rowcount
+        query = cls._build_delete_sql(table, where_clause)
+        with (await cls.get_cursor()) as cur:
+            await cur.execute(query, values)
+            return cur.rowcount
 
     @classmethod
-    @coroutine
-    @nt_cursor
-    def select(cls, cur, table: str, order_by: str=None, columns: list=None, where_keys: list=None, limit=100,
-               offset=0, group_by:str = None, use_replica=False):
+    async def select(cls, table: str, order_by: str=None, columns: list=None, where_keys: list=None, limit=_UNSET,
+                     offset=0, group_by:str = None, use_replica=False, stream: bool=False, chunk_size: int=2000):
         """
         Creates a select query for selective columns with where keys
         Supports multiple where claus with and or or both
@@ -413,8 +545,11 @@ class PostgresStore:
             order_by: a string indicating column name to order the results on
             columns: list of columns to select from
             where_keys: list of dictionary
-            limit: the limit on the number of results
+            limit: the limit on the number of results, None for no limit.
+                   Defaults to 100, or to no limit when streaming
             offset: offset on the results
+            stream: fetch the results in batches from a server-side cursor instead of all at once
+            chunk_size: number of rows in each batch when streaming
 
             example of where keys: [{'name':('>', 'cip'),'url':('=', 'cip.com'},{'type':{'<=', 'manufacturer'}}]
             where_clause will look like ((name>%s and url=%s) or (type <= %s))
@@ -422,90 +557,141 @@ class PostgresStore:
 
         Returns:
             A list of 'Record' object with table columns as properties
+            or, when streaming, an async iterator over lists of at most chunk_size such objects.
+            The stream holds a pooled connection in an open transaction until it is exhausted or closed, so
+            a caller that may stop early should iterate it inside contextlib.aclosing or call its aclose()
 
         """
-
-        if columns:
-            columns_string = cls._COMMA.join(columns)
-            if group_by:
-                if where_keys:
-                    where_clause, values = cls._get_where_clause_with_values(where_keys)
-                    if order_by:
-                        query = cls._select_selective_column_with_condition_and_order_by_group.format(columns_string, table, where_clause,
-                                                                                   group_by ,order_by, limit, offset)
-                    else:
-                        query = cls._select_selective_column_with_condition_group.format(columns_string, table, where_clause,
-                                                                                    group_by,limit, offset)
-                    q, t = query, values
-                else:
-                    if order_by:
-                        query = cls._select_selective_column_with_order_by_group.format(columns_string, table, group_by, order_by, limit, offset)
-                    else:
-                        query = cls._select_selective_column_group.format(columns_string, table, group_by, limit, offset)
-                    q, t = query, ()
-            else:
-                if where_keys:
-                    where_clause, values = cls._get_where_clause_with_values(where_keys)
-                    if order_by:
-                        query = cls._select_selective_column_with_condition_and_order_by.format(columns_string, table, where_clause,
-                                                                                   order_by, limit, offset)
-                    else:
-                        query = cls._select_selective_column_with_condition.format(columns_string, table, where_clause,
-                                                                                    limit, offset)
-                    q, t = query, values
-                else:
-                    if order_by:
-                        query = cls._select_selective_column_with_order_by.format(columns_string, table, order_by, limit, offset)
-                    else:
-                        query = cls._select_selective_column.format(columns_string, table, limit, offset)
-                    q, t = query, ()
+        if limit is _UNSET:
+            limit = None if stream else 100
+        if where_keys:
+            where_clause, values = cls._get_where_clause_with_values(where_keys)
         else:
-            if where_keys:
-                where_clause, values = cls._get_where_clause_with_values(where_keys)
-                if order_by:
-                    query = cls._select_all_string_with_condition_and_order_by.format(table, where_clause, order_by, limit, offset)
-                else:
-                    query = cls._select_all_string_with_condition.format(table, where_clause, limit, offset)
-                q, t = query, values
-            else:
-                if order_by:
-                    query = cls._select_all_string_with_order_by.format(table, order_by, limit, offset)
-                else:
-                    query = cls._select_all_string.format(table, limit, offset)
-                q, t = query, ()
-        yield from cur.execute(q, t)
-        return (yield from cur.fetchall())
+            where_clause, values = None, ()
+        query = cls._build_select_sql(table, tuple(columns) if columns else None, where_clause, order_by, group_by)
+        if stream:
+            return cls._stream(query, values + (limit, offset), chunk_size, use_replica)
+        with (await cls.get_cursor(_CursorType.NAMEDTUPLE, use_replica)) as cur:
+            await cur.execute(query, values + (limit, offset))
+            return await cur.fetchall()
 
     @classmethod
-    @coroutine
-    @nt_cursor
-    def call_stored_procedure(cls, cur, procname, parameters=None, timeout=None):
-        yield from cur.callproc(procname, parameters=parameters, timeout=timeout)
-        return (yield from cur.fetchall())
+    async def call_stored_procedure(cls, procname, parameters=None, timeout=None):
+        with (await cls.get_cursor(_CursorType.NAMEDTUPLE)) as cur:
+            await cur.callproc(procname, parameters=parameters, timeout=timeout)
+            return await cur.fetchall()
 
     @classmethod
-    @coroutine
-    @cursor
-    def mogrify(cls, cur, query, parameters=None):
-        return cur.mogrify(query, parameters=parameters)
+    async def mogrify(cls, query, parameters=None):
+        with (await cls.get_cursor()) as cur:
+            return cur.mogrify(query, parameters=parameters)
 
     @classmethod
-    @coroutine
-    @nt_cursor
-    def raw_sql(cls, cur, query: str, values: tuple, use_replica=False):
+    async def raw_sql(cls, query: str, values: tuple, use_replica=False, stream: bool=False, chunk_size: int=2000,
+                      *, prepared_name: str=None):
         """
         Run a raw sql query
 
         Args:
             query : query string to execute
             values : tuple of values to be used with the query
+            stream : fetch the results in batches from a server-side cursor instead of all at once
+            chunk_size : number of rows in each batch when streaming
+            prepared_name : run the query as a server-side prepared statement with this name, so that it is
+                            parsed and planned once per connection. Only positional %s placeholders are supported
+                            and the parameter types are inferred by the server when the statement is prepared.
+                            A name can only be used for one query and can't be combined with stream
 
         Returns:
             result of query as list of named tuple
+            or, when streaming, an async iterator over lists of at most chunk_size named tuples,
+            which should be closed with aclose() if it is not read to the end (see select)
 
         """
-        yield from cur.execute(query, values)
-        return (yield from cur.fetchall())
+        if stream:
+            if prepared_name:
+                raise ValueError('prepared_name is not supported with stream')
+            return cls._stream(query, values, chunk_size, use_replica)
+        with (await cls.get_cursor(_CursorType.NAMEDTUPLE, use_replica)) as cur:
+            if prepared_name:
+                await cls._execute_prepared(cur, prepared_name, query, values)
+            else:
+                await cur.execute(query, values)
+            return await cur.fetchall()
+
+    @classmethod
+    async def _execute_prepared(cls, cur, name: str, query: str, values: tuple):
+        """
+        Executes query as the prepared statement name, preparing it first if the cursor's connection has not seen it
+        """
+        prepared = cls._prepared.setdefault(cur.connection, {})
+        prepared_query = prepared.get(name)
+        if prepared_query is None:
+            statement = query
+            if values is not None:
+                statement = query % tuple(f'${i}' for i in range(1, len(values) + 1))
+            await cur.execute(f"prepare {name} as {statement}")
+            prepared[name] = query
+        elif prepared_query != query:
+            raise ValueError(f'prepared statement {name} is already used for a different query')
+        if values:
+            await cur.execute(f"execute {name} ({_placeholders(len(values))});", values)
+        else:
+            await cur.execute(f"execute {name};")
+
+    @classmethod
+    async def _stream(cls, query: str, values: tuple, chunk_size: int, use_replica=False):
+        """
+        Runs query through a server-side cursor so that only chunk_size rows are held in memory at a time.
+        The connection and its transaction are only released once the generator is exhausted or closed
+
+        Yields:
+            lists of at most chunk_size named tuples
+        """
+        with (await cls.get_cursor(_CursorType.NAMEDTUPLE, use_replica)) as cur:
+            # server-side cursors only live inside a transaction and aiopg connections are in autocommit mode
+            await cur.execute('BEGIN')
+            try:
+                await cur.execute(cls._declare_stream + query, values)
+                fetch = cls._fetch_stream.format(int(chunk_size))
+                while True:
+                    await cur.execute(fetch)
+                    rows = await cur.fetchall()
+                    if not rows:
+                        break
+                    yield rows
+            except BaseException:
+                await _rollback(cur)
+                raise
+            else:
+                await cur.execute('COMMIT')
+
+
+def _placeholders(n):
+    return ', '.join(['%s'] * n)
+
+
+_JSON_TEXT_TYPES = (datetime.datetime, datetime.date, datetime.time, uuid.UUID, decimal.Decimal)
+
+
+def _json_default(value):
+    # only types whose text form the server parses back to the same value, the rest would be stored wrongly
+    if isinstance(value, _JSON_TEXT_TYPES):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not supported by bulk_insert(as_json=True)')
+
+
+async def _rollback(cur):
+    """
+    Rolls back the cursor's transaction, unless aiopg has already closed the connection (as it does when a query
+    is cancelled). Failures are logged rather than raised so that they never replace the error being handled
+    """
+    if cur.closed or cur.connection.closed:
+        return
+    try:
+        await cur.execute('ROLLBACK')
+    except Exception:
+        logger.exception("Failed to roll back transaction")
 
 
 @contextmanager
@@ -3,7 +3,7 @@ Added SQL v2 to support connection to multiple DBs from one service.
 Instantiate PostgresStoreV2 class with DB params in-order to connect to a DB
 """
 
-from asyncio import coroutine
+from types import coroutine
 from contextlib import contextmanager
 from functools import wraps
 from enum import Enum
@@ -170,7 +170,9 @@ class PostgresStoreV2:
         self._pool = None
 
         # Initialize periodic cleaning of connections
-        asyncio.async(self._periodic_cleansing())
+        self._cleanser_task = None
+        if refresh_period > 0:
+            self._cleanser_task = asyncio.ensure_future(self._periodic_cleansing())
 
     @coroutine
     def _initialize_pool(self):
@@ -188,17 +190,27 @@ class PostgresStoreV2:
     def initialize_pool(self):
         yield from self._initialize_pool()
 
-    @coroutine
-    def _periodic_cleansing(self):
+    async def _periodic_cleansing(self):
         """
         Periodically cleanses idle connections in pool
         """
-        if self.refresh_period > 0:
-            yield from asyncio.sleep(self.refresh_period * 60)
+        while self.refresh_period > 0:
+            await asyncio.sleep(self.refresh_period * 60)
             logging.getLogger().info("Clearing unused DB connections")
             if self._pool:
-                yield from self._pool.clear()
-            asyncio.async(self._periodic_cleansing())
+                await self._pool.clear()
+
+    async def shutdown(self):
+        """
+        Stops the periodic cleansing and closes the connection pool
+        """
+        if self._cleanser_task is not None:
+            self._cleanser_task.cancel()
+            self._cleanser_task = None
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
 
     @coroutine
     def get_cursor(self, cursor_type=_CursorType.PLAIN) -> Cursor:
@@ -285,8 +297,10 @@ class PostgresStoreV2:
         for record in records:
             value_ordered.append([record[key] for key in records[0]])
         value_place_holder = self._LPAREN + (self._PLACEHOLDER * len(records[0]))[:-1] + self._RPAREN
-        values = ','.join(
-            (yield from cur.mogrify(value_place_holder, tuple(rec))).decode("utf-8") for rec in value_ordered)
+        mogrified = []
+        for rec in value_ordered:
+            mogrified.append((yield from cur.mogrify(value_place_holder, tuple(rec))).decode("utf-8"))
+        values = ','.join(mogrified)
         yield from cur.execute(self._bulk_insert_string.format(table, keys) + values + self._return_val)
         return (yield from cur.fetchall())
 
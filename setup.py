@@ -6,4 +6,5 @@ setup(name='cauldron',
       author_email='ankitchandawala@gmail.com',
       url='https://github.com/nerandell/cauldron',
       description='Utils to reduce boilerplate code',
-      packages=['cauldron'], install_requires=['aiopg', 'aioredis', 'psycopg2','elasticsearch'])
+      packages=['cauldron'], install_requires=['aiopg', 'aioredis', 'psycopg2','elasticsearch', 'xxhash'],
+      extras_require={'orjson': ['orjson']})